@@ -1,12 +1,234 @@
 import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import knime.extension as knext
 from knime.types.chemistry import to_rdkit_series, is_molecule
 from knime.types.chemistry import SmilesValue
 from rdkit import Chem
 import selfies as sf
 import pandas as pd
+import pyarrow as pa
 
 LOGGER = logging.getLogger(__name__)   
+
+# selfies keeps its semantic constraints in module-global state. Every conversion takes this lock and
+# makes sure the constraint table it was handed is the one installed while it runs, so nodes running
+# concurrently in the same process never see each other's presets.
+_CONSTRAINTS_LOCK = threading.Lock()
+# Number of open _semantic_constraints_scope blocks and the constraints installed before the first one
+_constraint_scopes = 0
+_constraints_before_scopes = None
+
+
+class ConstraintPresetOptions(knext.EnumParameterOptions):
+    DEFAULT = ("Default", "The default selfies constraints, including common charged atoms.")
+    OCTET_RULE = ("Octet rule", "Bonding capacities that strictly follow the octet rule.")
+    HYPERVALENT = ("Hypervalent", "Relaxed bonding capacities that allow hypervalent atoms (e.g. N, Cl, Br, I).")
+
+
+@lru_cache(maxsize=None)
+def compile_constraints(preset: str) -> tuple:
+    """
+    Look up a constraint preset name (e.g. "DEFAULT") once and return it as an immutable, hashable
+    table of sorted (atom, bonding capacity) pairs that can be handed to the conversion code.
+    This only freezes the preset; installing it in selfies still has a cost, see _convert_values.
+    """
+    constraints = sf.get_preset_constraints(preset.lower())
+    return tuple(sorted(constraints.items()))
+
+
+@contextmanager
+def _semantic_constraints_scope():
+    """
+    Restore the selfies constraints that were installed before the first of any overlapping scopes
+    once the last of them is left. Node executions run inside a scope, so _convert_values can leave
+    its table installed between batches without it outliving the nodes that use it.
+    """
+    global _constraint_scopes, _constraints_before_scopes
+    with _CONSTRAINTS_LOCK:
+        if _constraint_scopes == 0:
+            _constraints_before_scopes = sf.get_semantic_constraints()
+        _constraint_scopes += 1
+    try:
+        yield
+    finally:
+        with _CONSTRAINTS_LOCK:
+            _constraint_scopes -= 1
+            if _constraint_scopes == 0:
+                if sf.get_semantic_constraints() != _constraints_before_scopes:
+                    sf.set_semantic_constraints(_constraints_before_scopes)
+                _constraints_before_scopes = None
+
+
+def _convert_values(values, convert, constraints: tuple) -> list:
+    """
+    Apply convert to every value with the given constraint table installed in selfies.
+    Values that are empty, not strings or fail to convert yield None.
+
+    Installing a table re-validates it and clears selfies' internal caches, so it only happens when
+    a different table is installed, e.g. when batches of two nodes with different presets interleave.
+    The table stays installed afterwards; see _semantic_constraints_scope for restoring the previous one.
+    """
+    with _CONSTRAINTS_LOCK:
+        requested = dict(constraints)
+        if sf.get_semantic_constraints() != requested:
+            sf.set_semantic_constraints(requested)
+        results = []
+        for s in values:
+            result = None
+            if isinstance(s, str) and s:
+                try:
+                    result = convert(s)
+                except Exception:
+                    result = None
+            results.append(result)
+        return results
+
+
+# Maximum number of batches handed to the conversion thread but not yet written back. Keeps memory
+# bounded and makes reading wait when the conversion falls behind.
+_PIPELINE_QUEUE_SIZE = 2
+
+
+class _StageTimer:
+    """Accumulates the time a pipeline stage spent working (busy) and waiting on another stage (idle)."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.busy = 0.0
+        self.idle = 0.0
+
+    def __str__(self):
+        return f"{self.name} busy {self.busy:.2f}s / idle {self.idle:.2f}s"
+
+
+def _output_arrow_type(column: str, sample):
+    """
+    Return the Arrow type KNIME stores a column holding values like sample in. The pipeline uses it
+    to pin the output column's type, which KNIME cannot infer from a batch without any values.
+    """
+    table = knext.Table.from_pandas(pd.DataFrame({column: [sample]}))
+    return table.to_pyarrow().schema.field(column).type
+
+
+def _column_values(table, column: str):
+    """
+    Decode a single column of a KNIME Arrow table (whose first column holds the RowIDs) into a
+    pandas Series, without converting any of the other columns.
+    """
+    selected = table.select([0, table.schema.get_field_index(column)])
+    return knext.Table.from_pyarrow(selected).to_pandas()[column]
+
+
+def _output_array(values, column: str, output_type):
+    """Encode the converted values as an Arrow array of output_type, even if all of them are missing."""
+    array = knext.Table.from_pandas(pd.DataFrame({column: values})).to_pyarrow().column(column)
+    if array.type != output_type:
+        if array.null_count == len(array):
+            array = pa.nulls(len(array), output_type)
+        else:
+            array = array.cast(output_type)
+    return array
+
+
+def _with_output_column(table, values, column: str, output_type):
+    """Append the converted values to a KNIME Arrow table as column, leaving all other columns as they are."""
+    return table.append_column(pa.field(column, output_type), _output_array(values, column, output_type))
+
+
+def _run_pipeline(exec_context, input_table, input_column: str, convert_values, output_column: str, output_type):
+    """
+    Read, convert and write input_table batch by batch so that converting one batch overlaps with
+    reading the next one and writing the previous one. Only input_column is decoded to pandas and
+    passed to convert_values, which returns the values of output_column; every other column is
+    carried over in its original Arrow form, so all written batches share the input schema plus
+    output_column of output_type.
+
+    Reading from and writing to KNIME stays on the calling node thread, as the KNIME table backend
+    does not document access from other threads, so reading and writing are serialized with each
+    other; only convert_values runs on a separate thread. At most _PIPELINE_QUEUE_SIZE batches are
+    in flight. The busy and idle time of every stage is logged once the node has finished, where
+    read idle is the time the node thread waited for a conversion before it could read the next
+    batch, write idle the time it waited for the remaining conversions after the last batch was read,
+    and convert idle the time the conversion thread had no batch to work on.
+    """
+    if input_table.num_rows == 0:
+        table = input_table.to_pyarrow()
+        values = convert_values(_column_values(table, input_column))
+        return knext.Table.from_pyarrow(_with_output_column(table, values, output_column, output_type))
+
+    read_timer, convert_timer, write_timer = _StageTimer("read"), _StageTimer("convert"), _StageTimer("write")
+    output_table = knext.BatchOutputTable.create()
+    num_rows = input_table.num_rows
+    written_rows = 0
+    pending = deque()
+
+    def convert(values):
+        start = time.perf_counter()
+        try:
+            return convert_values(values)
+        finally:
+            convert_timer.busy += time.perf_counter() - start
+
+    def write_oldest(waiting_timer):
+        # Waiting for the conversion is charged to the stage that is held up by it
+        nonlocal written_rows
+        table, future = pending.popleft()
+        start = time.perf_counter()
+        values = future.result()
+        waiting_timer.idle += time.perf_counter() - start
+        start = time.perf_counter()
+        output_table.append(_with_output_column(table, values, output_column, output_type))
+        write_timer.busy += time.perf_counter() - start
+        written_rows += len(table)
+        exec_context.set_progress(written_rows / num_rows)
+
+    started = time.perf_counter()
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="selfies-convert")
+    try:
+        batches = iter(input_table.batches())
+        while True:
+            if exec_context.is_canceled():
+                raise RuntimeError("Execution canceled")
+            start = time.perf_counter()
+            batch = next(batches, None)
+            if batch is None:
+                break
+            table = batch.to_pyarrow()
+            values = _column_values(table, input_column)
+            read_timer.busy += time.perf_counter() - start
+            pending.append((table, pool.submit(convert, values)))
+            while pending and (len(pending) >= _PIPELINE_QUEUE_SIZE or pending[0][1].done()):
+                write_oldest(read_timer)
+        while pending:
+            if exec_context.is_canceled():
+                raise RuntimeError("Execution canceled")
+            write_oldest(write_timer)
+    finally:
+        for _, future in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
+
+    convert_timer.idle = max(0.0, time.perf_counter() - started - convert_timer.busy)
+    LOGGER.info(
+        "Pipeline stages (read and write share the node thread): %s | %s | %s", read_timer, convert_timer, write_timer
+    )
+    return output_table
+
+
+def _constraint_preset_parameter():
+    return knext.EnumParameter(
+        label="Semantic constraints",
+        description="Bonding capacity preset used by selfies for this node only.",
+        default_value=ConstraintPresetOptions.DEFAULT.name,
+        enum=ConstraintPresetOptions,
+        since_version="0.2.0",
+    )
+
     
 # @knext.node(name="RDKitMol from any Mol Type", node_type=knext.NodeType.MANIPULATOR, icon_path="icon.png", category="/")
 # @knext.input_table(name="Input Data", description="Input table containing any mol type")
@@ -101,21 +323,23 @@ class SmilesToSelfies:
         default_value="SELFIES"
     )
 
+    constraint_preset = _constraint_preset_parameter()
+
     def configure(self, configure_context, input_schema):
         return input_schema.append(knext.Column(knext.string(), str(self.output_column_name)))
 
     def execute(self, exec_context, input_table):
-        df = input_table.to_pandas()
-        def to_selfies(s):
-            if isinstance(s, str) and s:
-                try:
-                    return sf.encoder(s)
-                except Exception:
-                    return None
-            return None
+        constraints = compile_constraints(self.constraint_preset)
         out_col = str(self.output_column_name)
-        df[out_col] = df[self.smiles_column].apply(to_selfies)
-        return knext.Table.from_pandas(df)
+
+        def convert_values(values):
+            return _convert_values(values, sf.encoder, constraints)
+
+        output_type = _output_arrow_type(out_col, "[C]")
+        with _semantic_constraints_scope():
+            return _run_pipeline(
+                exec_context, input_table, self.smiles_column, convert_values, out_col, output_type
+            )
 
 
 @knext.node(name="SELFIES to SMILES", node_type=knext.NodeType.MANIPULATOR, icon_path="icon.png", category="/")
@@ -138,22 +362,23 @@ class SelfiesToSmiles:
         default_value="SMILES"
     )
 
+    constraint_preset = _constraint_preset_parameter()
+
     def configure(self, configure_context, input_schema):
         return input_schema.append(knext.Column(knext.logical(SmilesValue), str(self.output_column_name)))
 
     def execute(self, exec_context, input_table):
-        df = input_table.to_pandas()
-        def to_smiles(s):
-            if isinstance(s, str) and s:
-                try:
-                    return sf.decoder(s)
-                except Exception:
-                    return None
-            return None
+        constraints = compile_constraints(self.constraint_preset)
         out_col = str(self.output_column_name)
-        df[out_col] = df[self.selfies_column].apply(to_smiles)
-        # Cast to SmilesValue for correct KNIME data type
-        df[out_col] = df[out_col].apply(lambda x: SmilesValue(x) if x else None)
-        return knext.Table.from_pandas(df)
+
+        def convert_values(values):
+            # Cast to SmilesValue for correct KNIME data type
+            return [SmilesValue(x) if x else None for x in _convert_values(values, sf.decoder, constraints)]
+
+        output_type = _output_arrow_type(out_col, SmilesValue("C"))
+        with _semantic_constraints_scope():
+            return _run_pipeline(
+                exec_context, input_table, self.selfies_column, convert_values, out_col, output_type
+            )
 
 
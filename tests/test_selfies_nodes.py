@@ -0,0 +1,306 @@
+import threading
+import unittest
+from unittest import mock
+import pandas as pd
+import selfies as sf
+import knime.extension as knext
+
+from src.extension import (
+    SelfiesToSmiles,
+    SmilesToSelfies,
+    compile_constraints,
+    _convert_values,
+    _output_arrow_type,
+    _run_pipeline,
+    _semantic_constraints_scope,
+)
+
+
+class FakeBatch:
+    def __init__(self, table):
+        self.table = table
+
+    def to_pyarrow(self):
+        return self.table
+
+
+class FakeTable:
+    """
+    Input table that yields the given DataFrames as batches and can fail before a given batch.
+    Like a KNIME table, all batches are slices of one Arrow table and so share its schema.
+    """
+
+    def __init__(self, frames, columns=(), fail_before=None):
+        self.frames = frames
+        self.fail_before = fail_before
+        if frames:
+            df = pd.concat(frames)
+        else:
+            df = pd.DataFrame({column: pd.Series(dtype=str) for column in columns})
+        self.table = knext.Table.from_pandas(df).to_pyarrow()
+
+    @property
+    def num_rows(self):
+        return len(self.table)
+
+    def batches(self):
+        offset = 0
+        for i, df in enumerate(self.frames):
+            if i == self.fail_before:
+                raise OSError("reading batch failed")
+            yield FakeBatch(self.table.slice(offset, len(df)))
+            offset += len(df)
+
+    def to_pyarrow(self):
+        return self.table
+
+
+class FakeExecutionContext:
+    """Execution context that reports cancellation once is_canceled was asked cancel_after times."""
+
+    def __init__(self, cancel_after=None):
+        self.cancel_after = cancel_after
+        self.cancel_checks = 0
+        self.progress = []
+
+    def is_canceled(self):
+        self.cancel_checks += 1
+        return self.cancel_after is not None and self.cancel_checks > self.cancel_after
+
+    def set_progress(self, progress):
+        self.progress.append(progress)
+
+
+class RecordingOutputTable:
+    """Stands in for knext.BatchOutputTable and keeps every appended batch."""
+
+    def __init__(self):
+        self.batches = []
+
+    def append(self, batch):
+        self.batches.append(batch)
+
+    def to_pandas(self):
+        return pd.concat([knext.Table.from_pyarrow(batch).to_pandas() for batch in self.batches])
+
+
+def split_batches(df, batch_size):
+    return [df.iloc[i:i + batch_size] for i in range(0, len(df), batch_size)]
+
+
+def execute_node(node, *frames):
+    """Execute node on a table made of the given batches and return the recording output table."""
+    output = RecordingOutputTable()
+    with mock.patch.object(knext.BatchOutputTable, "create", return_value=output):
+        node.execute(FakeExecutionContext(), FakeTable(list(frames)))
+    return output
+
+
+def pipeline_threads():
+    return [t for t in threading.enumerate() if t.name.startswith("selfies-convert")]
+
+
+class TestConstraintPresets(unittest.TestCase):
+    """Tests for the per-node semantic constraint presets."""
+
+    def tearDown(self):
+        sf.set_semantic_constraints()
+
+    def test_compile_constraints_is_cached_and_immutable(self):
+        table = compile_constraints("HYPERVALENT")
+        self.assertIs(table, compile_constraints("HYPERVALENT"))
+        self.assertIsInstance(table, tuple)
+        self.assertEqual(dict(table), sf.get_preset_constraints("hypervalent"))
+
+    def test_convert_values_installs_and_restores_constraints(self):
+        sf.set_semantic_constraints("hypervalent")
+        before = sf.get_semantic_constraints()
+
+        # Sulfur with six bonds violates the octet rule but is allowed by the default preset
+        with _semantic_constraints_scope():
+            octet = _convert_values(["CS(=O)(=O)C"], sf.encoder, compile_constraints("OCTET_RULE"))
+            default = _convert_values(["CS(=O)(=O)C"], sf.encoder, compile_constraints("DEFAULT"))
+        self.assertEqual(octet, [None])
+        self.assertIsNotNone(default[0])
+        self.assertEqual(sf.get_semantic_constraints(), before)
+
+        sf.set_semantic_constraints("octet_rule")
+        with _semantic_constraints_scope():
+            hypervalent = _convert_values(["[Cl][=C][=C]"], sf.decoder, compile_constraints("HYPERVALENT"))
+            default = _convert_values(["[Cl][=C][=C]"], sf.decoder, compile_constraints("DEFAULT"))
+        self.assertEqual(hypervalent, ["Cl=C=C"])
+        self.assertEqual(default, ["ClC=C"])
+        self.assertEqual(sf.get_semantic_constraints(), sf.get_preset_constraints("octet_rule"))
+
+    def test_concurrent_presets_do_not_leak(self):
+        sf.set_semantic_constraints("hypervalent")
+        before = sf.get_semantic_constraints()
+        results = {"OCTET_RULE": [], "DEFAULT": []}
+        start = threading.Barrier(2)
+
+        def convert_repeatedly(preset):
+            constraints = compile_constraints(preset)
+            with _semantic_constraints_scope():
+                start.wait()
+                for _ in range(200):
+                    results[preset].extend(_convert_values(["CS(=O)(=O)C"], sf.encoder, constraints))
+
+        threads = [threading.Thread(target=convert_repeatedly, args=(preset,)) for preset in results]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results["OCTET_RULE"], [None] * 200)
+        self.assertEqual(results["DEFAULT"], [sf.encoder("CS(=O)(=O)C")] * 200)
+        self.assertEqual(sf.get_semantic_constraints(), before)
+
+    def test_convert_values_skips_invalid_values(self):
+        results = _convert_values(["CC", "", None], sf.encoder, compile_constraints("DEFAULT"))
+        self.assertEqual(results, ["[C][C]", None, None])
+
+
+class TestSmilesToSelfiesConstraints(unittest.TestCase):
+    """Tests that the node's constraint preset reaches the conversion."""
+
+    def test_execute_uses_node_constraint_preset(self):
+        input_df = pd.DataFrame({"Smiles": ["CS(=O)(=O)C", "CC"]})
+
+        default_node = SmilesToSelfies()
+        default_node.smiles_column = "Smiles"
+        octet_node = SmilesToSelfies()
+        octet_node.smiles_column = "Smiles"
+        octet_node.constraint_preset = "OCTET_RULE"
+
+        default_df = execute_node(default_node, input_df).to_pandas()
+        octet_df = execute_node(octet_node, input_df).to_pandas()
+
+        self.assertEqual(list(default_df["SELFIES"]), [sf.encoder("CS(=O)(=O)C"), "[C][C]"])
+        self.assertTrue(pd.isna(octet_df["SELFIES"].iloc[0]))
+        self.assertEqual(octet_df["SELFIES"].iloc[1], "[C][C]")
+
+
+class TestRunPipeline(unittest.TestCase):
+    """Tests for the batched read / convert / write pipeline."""
+
+    def setUp(self):
+        self.input_df = pd.DataFrame({"In": [f"v{i}" for i in range(10)]})
+        self.output_type = _output_arrow_type("Out", "x")
+
+    def run_pipeline(self, table, convert_values, exec_context=None):
+        output = RecordingOutputTable()
+        with mock.patch.object(knext.BatchOutputTable, "create", return_value=output):
+            _run_pipeline(exec_context or FakeExecutionContext(), table, "In", convert_values, "Out", self.output_type)
+        return output
+
+    @staticmethod
+    def upper(values):
+        return [v.upper() for v in values]
+
+    def test_keeps_row_order_across_batches(self):
+        exec_context = FakeExecutionContext()
+        output = self.run_pipeline(FakeTable(split_batches(self.input_df, 3)), self.upper, exec_context)
+
+        self.assertEqual(len(output.batches), 4)
+        output_df = output.to_pandas()
+        self.assertEqual(list(output_df["In"]), list(self.input_df["In"]))
+        self.assertEqual(list(output_df["Out"]), [f"V{i}" for i in range(10)])
+        self.assertEqual(exec_context.progress[-1], 1.0)
+        self.assertEqual(pipeline_threads(), [])
+
+    def test_logs_stage_times(self):
+        with self.assertLogs("src.extension", level="INFO") as logs:
+            self.run_pipeline(FakeTable(split_batches(self.input_df, 3)), self.upper)
+
+        report = "\n".join(logs.output)
+        for stage in ("read", "convert", "write"):
+            self.assertRegex(report, rf"{stage} busy \d+\.\d+s / idle \d+\.\d+s")
+
+    def test_read_error_reaches_caller(self):
+        table = FakeTable(split_batches(self.input_df, 3), fail_before=2)
+        with self.assertRaises(OSError):
+            self.run_pipeline(table, self.upper)
+        self.assertEqual(pipeline_threads(), [])
+
+    def test_convert_error_reaches_caller(self):
+        def fail_on_second_batch(values):
+            if "v3" in list(values):
+                raise ValueError("conversion failed")
+            return self.upper(values)
+
+        with self.assertRaises(ValueError):
+            self.run_pipeline(FakeTable(split_batches(self.input_df, 3)), fail_on_second_batch)
+        self.assertEqual(pipeline_threads(), [])
+
+    def test_cancellation_stops_pipeline(self):
+        converted = []
+
+        def record(values):
+            converted.append(len(values))
+            return self.upper(values)
+
+        with self.assertRaises(RuntimeError):
+            self.run_pipeline(FakeTable(split_batches(self.input_df, 1)), record, FakeExecutionContext(cancel_after=2))
+        self.assertLess(len(converted), 10)
+        self.assertEqual(pipeline_threads(), [])
+
+    def test_empty_table_bypasses_pipeline(self):
+        create = mock.Mock()
+        with mock.patch.object(knext.BatchOutputTable, "create", create):
+            result = _run_pipeline(
+                FakeExecutionContext(), FakeTable([], columns=["In"]), "In", self.upper, "Out", self.output_type
+            )
+        create.assert_not_called()
+        output_df = result.to_pandas()
+        self.assertIn("Out", output_df.columns)
+        self.assertEqual(len(output_df), 0)
+
+
+class TestInvalidBatches(unittest.TestCase):
+    """A batch in which every value is missing or fails to convert must keep every column's type."""
+
+    def assert_same_schema(self, output):
+        schemas = [batch.schema for batch in output.batches]
+        self.assertTrue(all(schema == schemas[0] for schema in schemas))
+
+    def test_batch_with_missing_input_and_pass_through_values(self):
+        df = pd.DataFrame({"Smiles": ["CC", None, None, "O"], "Note": ["a", None, None, "b"]})
+        node = SmilesToSelfies()
+        node.smiles_column = "Smiles"
+
+        output = execute_node(node, df.iloc[0:1], df.iloc[1:3], df.iloc[3:4])
+
+        self.assertEqual(len(output.batches), 3)
+        self.assert_same_schema(output)
+        output_df = output.to_pandas()
+        self.assertEqual(list(output_df["SELFIES"].isna()), [False, True, True, False])
+        self.assertEqual(list(output_df["Note"].isna()), [False, True, True, False])
+
+    def test_smiles_to_selfies_with_invalid_batch(self):
+        df = pd.DataFrame({"Smiles": ["CC", "O", "not a smiles", "", "CCO"]})
+        node = SmilesToSelfies()
+        node.smiles_column = "Smiles"
+
+        output = execute_node(node, df.iloc[0:2], df.iloc[2:4], df.iloc[4:5])
+
+        self.assert_same_schema(output)
+        values = list(output.to_pandas()["SELFIES"])
+        self.assertEqual(values[:2], ["[C][C]", "[O]"])
+        self.assertTrue(all(pd.isna(v) for v in values[2:4]))
+        self.assertEqual(values[4], "[C][C][O]")
+
+    def test_selfies_to_smiles_with_invalid_first_batch(self):
+        df = pd.DataFrame({"Selfies": [None, "", "[C][C]", "[O]"]})
+        node = SelfiesToSmiles()
+        node.selfies_column = "Selfies"
+
+        output = execute_node(node, df.iloc[0:2], df.iloc[2:4])
+
+        self.assert_same_schema(output)
+        values = list(output.to_pandas()["SMILES"])
+        self.assertTrue(all(pd.isna(v) for v in values[:2]))
+        self.assertEqual([str(v) for v in values[2:]], ["CC", "O"])
+
+
+if __name__ == "__main__":
+    unittest.main()